@@ -1,53 +1,315 @@
 import requests
 from bs4 import BeautifulSoup
+import xml.etree.ElementTree as ET
+import numpy as np
 import sqlite3
+import json
+import time
+import warnings
+import threading
 from pymongo import MongoClient
-from datetime import datetime
+from datetime import datetime, timezone
 from pprint import pprint
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
-def get_quotes():
-    """
-    Retrieves forex quotes from centralcharts.com and returns a list of dictionaries containing 
-    the base currency, quote currency, price, and scrape time.
+# Quotes without a quote time sort as the oldest, so they only fill currencies no dated source has
+OLDEST_QUOTE_TIME = datetime.min.replace(tzinfo=timezone.utc)
 
-    Returns:
-    list: A list of dictionaries representing the forex quotes.
+class QuoteSource:
     """
-    url = "https://www.centralcharts.com/en/price-list-ranking/ALL/asc/ts_507-usd-currency-pairs--qc_1-alphabetical-order"
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
-    print('Getting Quotes')
-    response = requests.get(url, headers=headers)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    table = soup.find('table', class_='tabMini tabQuotes')
-    tbody = table.find('tbody')
-    trs = tbody.find_all('tr')
-
-    quotes = []
-    for tr in trs:
-        tds = tr.find_all('td')
-        symbol = tds[0].text.strip()
-        price = tds[1].text.strip()
-        base, quote = symbol[-7:].split('/')
-        price = float(price.replace(',', ''))
+    A source of forex quotes. Subclasses implement fetch, returning USD based quotes as dictionaries
+    containing the base currency, quote currency, price, quote time, scrape time and source name.
+    The quote time is when the source published the rate, in UTC, or None if the source doesn't say.
+    """
+    name = 'source'
 
+    def fetch(self, timeout):
+        raise NotImplementedError
+
+    def make_quote(self, base, quote, price, quote_time=None):
+        # Quotes which are not USD based are inverted so every source is anchored on USD
         if base != 'USD':
             base, quote = quote, base
             price = 1 / price
-
+        if quote_time is not None and quote_time.tzinfo is None:
+            quote_time = quote_time.replace(tzinfo=timezone.utc)
         scrape_time = datetime.now()
-        quote_info = {
+        return {
             'base': base,
             'quote': quote,
             'price': price,
-            'scrape_time': scrape_time
+            'quote_time': quote_time,
+            'scrape_time': scrape_time,
+            'source': self.name
         }
 
-        quotes.append(quote_info)
+class CentralChartsSource(QuoteSource):
+    name = 'centralcharts'
+    url = "https://www.centralcharts.com/en/price-list-ranking/ALL/asc/ts_507-usd-currency-pairs--qc_1-alphabetical-order"
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+    }
+
+    def fetch(self, timeout):
+        response = requests.get(self.url, headers=self.headers, timeout=timeout)
+        soup = BeautifulSoup(response.text, 'html.parser')
+        table = soup.find('table', class_='tabMini tabQuotes')
+        tbody = table.find('tbody')
+        trs = tbody.find_all('tr')
+
+        quotes = []
+        for tr in trs:
+            tds = tr.find_all('td')
+            symbol = tds[0].text.strip()
+            price = tds[1].text.strip()
+            base, quote = symbol[-7:].split('/')
+            price = float(price.replace(',', ''))
+            # The ranking table doesn't show when each price was quoted
+            quotes.append(self.make_quote(base, quote, price))
+        return quotes
+
+class OpenExchangeRatesSource(QuoteSource):
+    name = 'open.er-api'
+    url = 'https://open.er-api.com/v6/latest/USD'
+
+    def fetch(self, timeout):
+        response = requests.get(self.url, timeout=timeout)
+        data = response.json()
+        quote_time = datetime.fromtimestamp(data['time_last_update_unix'], tz=timezone.utc)
+        return [self.make_quote('USD', quote, float(price), quote_time)
+                for quote, price in data['rates'].items() if quote != 'USD']
+
+class ECBSource(QuoteSource):
+    name = 'ecb'
+    url = 'https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml'
+
+    def fetch(self, timeout):
+        response = requests.get(self.url, timeout=timeout)
+        root = ET.fromstring(response.content)
+        # The ECB publishes EUR based rates, so they are triangulated through EUR/USD
+        cubes = [cube for cube in root.iter() if cube.tag.endswith('Cube')]
+        # The reference rates only carry their date, which is taken as midnight UTC
+        quote_time = next(datetime.strptime(cube.get('time'), '%Y-%m-%d').replace(tzinfo=timezone.utc)
+                          for cube in cubes if cube.get('time'))
+        eur_rates = {cube.get('currency'): float(cube.get('rate')) for cube in cubes if cube.get('currency')}
+        eur_usd = eur_rates.pop('USD')
+        quotes = [self.make_quote('USD', quote, price / eur_usd, quote_time) for quote, price in eur_rates.items()]
+        quotes.append(self.make_quote('USD', 'EUR', 1 / eur_usd, quote_time))
+        return quotes
+
+class FixtureQuoteSource(QuoteSource):
+    """
+    A local stand-in for a quote source, serving quotes from a list or a JSON file of
+    {'base', 'quote', 'price'} dictionaries, optionally after a delay.
+    """
+    def __init__(self, name, quotes=None, path=None, delay=0, quote_time=None):
+        self.name = name
+        self.quotes = quotes
+        self.path = path
+        self.delay = delay
+        self.quote_time = quote_time
+
+    def fetch(self, timeout):
+        time.sleep(self.delay)
+        quotes = self.quotes
+        if quotes is None:
+            with open(self.path) as f:
+                quotes = json.load(f)
+        return [self.make_quote(q['base'], q['quote'], float(q['price']), self.quote_time) for q in quotes]
+
+def get_sources():
+    return [CentralChartsSource(), OpenExchangeRatesSource(), ECBSource()]
+
+def fetch_source(source, timeout):
+    try:
+        quotes = source.fetch(timeout)
+        print(f'Got {len(quotes)} forex quotes from {source.name}')
+        return quotes
+    except Exception as e:
+        print(f'Error getting quotes from {source.name}')
+        print(e)
+        return []
+
+def fetch_all_sources(sources, deadline=20):
+    """
+    Fetches every source concurrently, keeping whatever has arrived by the deadline.
+    The deadline bounds the whole fetch. Each source runs on a daemon thread, so a source which
+    misses it is abandoned and doesn't hold up the job or the interpreter's exit. The deadline is
+    also passed to the sources as their requests timeout, but that only limits each connect and
+    read, so it just stops abandoned threads from lingering forever.
+
+    Parameters:
+    sources (list): A list of QuoteSource.
+    deadline (int): The most seconds to wait for the sources.
+
+    Returns:
+    list: A list of quote lists, in the same order as sources. Sources which missed the deadline give an empty list.
+    """
+    results = [None] * len(sources)
+
+    def run(i, source):
+        results[i] = fetch_source(source, deadline)
+
+    threads = [threading.Thread(target=run, args=(i, source), daemon=True) for i, source in enumerate(sources)]
+    for thread in threads:
+        thread.start()
+    end_time = time.monotonic() + deadline
+    for thread in threads:
+        thread.join(max(0, end_time - time.monotonic()))
+    quote_lists = []
+    for source, thread, quotes in zip(sources, threads, results):
+        if thread.is_alive() or quotes is None:
+            print(f'{source.name} missed the {deadline}s deadline')
+            quotes = []
+        quote_lists.append(quotes)
+    return quote_lists
+
+def quote_sort_time(quote_info):
+    return quote_info['quote_time'] or OLDEST_QUOTE_TIME
+
+def merge_quotes(quote_lists):
+    """
+    Merges the quotes of several sources into one USD based rate set. For each currency the quote
+    with the latest quote time wins, quotes without a quote time count as the oldest, and ties go
+    to the source listed first.
+
+    Parameters:
+    quote_lists (list): A list of quote lists, in order of source priority.
+
+    Returns:
+    list: A list of dictionaries representing the merged forex quotes.
+    """
+    merged = {}
+    for quotes in reversed(quote_lists):
+        for quote_info in quotes:
+            current = merged.get(quote_info['quote'])
+            if current is None or quote_sort_time(quote_info) >= quote_sort_time(current):
+                merged[quote_info['quote']] = quote_info
+    return [merged[quote] for quote in sorted(merged)]
+
+def get_source_log_rates(quote_lists, currencies):
+    """
+    Returns a sources by currencies array of the log USD rates, with nan where a source has no quote.
+    """
+    index = {currency: i for i, currency in enumerate(currencies)}
+    source_log = np.full((len(quote_lists), len(currencies)), np.nan)
+    for s, source_quotes in enumerate(quote_lists):
+        for quote_info in source_quotes:
+            if quote_info['quote'] in index and quote_info['price'] > 0:
+                source_log[s, index[quote_info['quote']]] = np.log(quote_info['price'])
+    return source_log
+
+def find_outlier_quotes(quote_lists, quotes, tolerance=0.02):
+    """
+    Checks the triangular consistency of the merged rates against every source. For each pair of
+    currencies the cross rate implied by the merged USD rates is compared to the cross rate implied
+    by each source. A wrong rate disagrees on every pair it is in, so the currency with the largest
+    median log deviation is flagged while it is above the tolerance, then left out of the next pass.
+
+    Parameters:
+    quote_lists (list): A list of quote lists, one per source.
+    quotes (list): The merged quotes.
+    tolerance (float): The largest allowed log deviation, roughly a relative difference.
+
+    Returns:
+    list: The quote currencies flagged as outliers.
+    """
+    currencies = [quote_info['quote'] for quote_info in quotes]
+    merged_log = np.log([quote_info['price'] for quote_info in quotes])
+    source_log = get_source_log_rates(quote_lists, currencies)
+    # delta[s, i] is how far source s is from the merged USD rate of currency i
+    delta = source_log - merged_log
+    # The log cross rate error for the pair i/j is delta[s, j] - delta[s, i]
+    pair_error = np.abs(delta[:, None, :] - delta[:, :, None])
+    diagonal = np.arange(len(currencies))
+    pair_error[:, diagonal, diagonal] = np.nan
+    outliers = []
+    while True:
+        with warnings.catch_warnings():
+            # Currencies with no pairs left to compare get a nan score
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            scores = np.nanmedian(pair_error.transpose(1, 0, 2).reshape(len(currencies), -1), axis=1)
+        scores = np.nan_to_num(scores)
+        worst = int(np.argmax(scores))
+        if scores[worst] <= tolerance:
+            break
+        # An outlier skews the pairs of every other currency, so it is removed before scoring again
+        outliers.append(currencies[worst])
+        pair_error[:, worst, :] = np.nan
+        pair_error[:, :, worst] = np.nan
+    return outliers
+
+def replace_outlier_quotes(quote_lists, quotes, outliers, tolerance=0.02):
+    """
+    Replaces the merged quote of each outlier currency with the freshest quote that agrees with
+    the other sources. Each source's rates are first shifted by its median offset from the merged
+    rates of the consistent currencies, so a source anchored slightly differently on USD is still
+    comparable. The consensus rate of a currency is the median of the shifted source rates.
+
+    Parameters:
+    quote_lists (list): A list of quote lists, in order of source priority.
+    quotes (list): The merged quotes.
+    outliers (list): The currencies flagged by find_outlier_quotes.
+    tolerance (float): The largest allowed log deviation from the consensus.
+
+    Returns:
+    list: The currencies which no source could replace.
+    """
+    currencies = [quote_info['quote'] for quote_info in quotes]
+    index = {currency: i for i, currency in enumerate(currencies)}
+    merged_log = np.log([quote_info['price'] for quote_info in quotes])
+    source_log = get_source_log_rates(quote_lists, currencies)
+    consistent = np.array([currency not in outliers for currency in currencies])
+    with warnings.catch_warnings():
+        # Sources with no consistent currencies, or currencies no source covers, give nan
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        offsets = np.nan_to_num(np.nanmedian(source_log[:, consistent] - merged_log[consistent], axis=1))
+        shifted = source_log - offsets[:, None]
+        consensus = np.nanmedian(shifted, axis=0)
+    error = np.abs(shifted - consensus)
+
+    unresolved = []
+    for currency in outliers:
+        i = index[currency]
+        # One list per agreeing source, in source order, so merge_quotes can break ties by source
+        candidates = [[quote_info for quote_info in source_quotes if quote_info['quote'] == currency]
+                      for s, source_quotes in enumerate(quote_lists) if error[s, i] <= tolerance]
+        candidates = [source_quotes for source_quotes in candidates if source_quotes]
+        if not candidates:
+            unresolved.append(currency)
+            continue
+        # Same rule as merge_quotes, the freshest quote wins and ties go to the source listed first
+        replacement = merge_quotes(candidates)[0]
+        print(f"Replaced outlier {currency} from {quotes[i]['source']} with {replacement['source']}")
+        quotes[i] = replacement
+    return unresolved
+
+def get_quotes(sources=None, deadline=20):
+    """
+    Retrieves forex quotes from several sources concurrently and returns a list of dictionaries
+    containing the base currency, quote currency, price, and scrape time, with every quote based on USD.
+    Currencies whose merged rate is not consistent across the sources are replaced by a consistent
+    source's quote, or flagged as outliers if no source agrees.
+
+    Parameters:
+    sources (list): A list of QuoteSource, defaults to every live source.
+    deadline (int): The most seconds to wait for the sources.
+
+    Returns:
+    list: A list of dictionaries representing the forex quotes.
+    """
+    sources = sources or get_sources()
+    print('Getting Quotes')
+    quote_lists = fetch_all_sources(sources, deadline)
+    quotes = merge_quotes(quote_lists)
+    outliers = find_outlier_quotes(quote_lists, quotes) if quotes else []
+    outliers = set(replace_outlier_quotes(quote_lists, quotes, outliers)) if outliers else set()
+    for quote_info in quotes:
+        quote_info['outlier'] = quote_info['quote'] in outliers
+    if outliers:
+        print(f"Outlier forex quotes: {', '.join(sorted(outliers))}")
     print(f'Got {len(quotes)} forex quotes')
     return quotes
 
@@ -81,28 +343,34 @@ def generate_quote_pairs(quotes):
     print(f'Created {len(pairs)} forex pairs')
     return pairs
 
-def get_pair_price(quotes, base, quote):
+def get_usd_rates(quotes):
+    """
+    Returns a dictionary of currency to its USD based price, including USD itself.
+
+    Parameters:
+    quotes (list): A list of dictionaries representing the USD based forex quotes.
+
+    Returns:
+    dict: The price of one USD in each currency.
+    """
+    usd_rates = {quote_info['quote']: quote_info['price'] for quote_info in quotes if quote_info['base'] == 'USD'}
+    usd_rates['USD'] = 1
+    return usd_rates
+
+def get_pair_price(usd_rates, base, quote):
     """
     Returns the price of a currency pair using the USD as an intermediary.
 
     Parameters:
-    quotes (list): A list of dictionaries representing the forex quotes.
+    usd_rates (dict): The USD based prices, as returned by get_usd_rates.
     base (str): The base currency.
     quote (str): The quote currency.
 
     Returns:
     float: The price of the currency pair.
     """
-    # All quotes are calculated with USD as an intermediary
-    # Quotes which already use USD (is USD/EUR) need a USD to USD 
-    # Quote in the quotes array to compare through.
-    quotes.append({'base': 'USD', 'quote': 'USD', 'price': 1})
-    usd_to_base = usd_to_quote = None
-    for quote_info in quotes:
-        if quote_info['base'] == 'USD' and quote_info['quote'] == base:
-            usd_to_base = quote_info['price']
-        elif quote_info['base'] == 'USD' and quote_info['quote'] == quote:
-            usd_to_quote = quote_info['price']
+    usd_to_base = usd_rates.get(base)
+    usd_to_quote = usd_rates.get(quote)
 
     if usd_to_base is None or usd_to_quote is None:
         print(f"No quote found for base currency: {base} to {quote}")
@@ -127,14 +395,20 @@ def insert_forex_quotes_mongodb(quotes):
 
 def main():
     quotes = get_quotes()
+    if not quotes:
+        # insert_many rejects an empty list, and there is nothing to price anyway
+        print('No forex quotes from any source, skipping this run')
+        return
     insert_raw_forex_mongodb(quotes)
+    quotes = [quote_info for quote_info in quotes if not quote_info['outlier']]
     pairs = generate_quote_pairs(quotes)
+    usd_rates = get_usd_rates(quotes)
     print('Calculating pair prices')
     quotes_array = []
     for currency in pairs:
         base = currency['base']
         quote = currency['quote']
-        price = get_pair_price(quotes, base, quote)
+        price = get_pair_price(usd_rates, base, quote)
         if price == 0:
             continue
         quote_time = datetime.now()
@@ -144,6 +418,9 @@ def main():
             'price': price, 
             'quote_time': quote_time })
     print(f'Calculated prices for {len(quotes_array)}/{len(pairs)} pairs')
+    if not quotes_array:
+        print('No forex pairs could be priced')
+        return
     insert_forex_quotes_mongodb(quotes_array)
     print('Forex Scrape Complete!')
 
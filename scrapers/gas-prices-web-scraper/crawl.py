@@ -0,0 +1,74 @@
+from gas_site import GasSite
+from work_queue import WorkQueue
+from main import discover_cities
+import sqlite3
+import socket
+import os
+import sys
+import time
+from datetime import datetime
+
+def coordinator():
+    """
+    Discovers the cities of every state without crawling their prices, then writes a task
+    for every city in the cities table into the work queue.
+    """
+    discover_cities()
+    queue = WorkQueue()
+    pending = queue.enqueue_cities()
+    print(f'{pending} city pages queued')
+
+def crawl_city(task, timeout):
+    city_gas_page = GasSite(task['url'])
+    city_gas_page.fetch_soup(timeout=timeout)
+    gas_prices = city_gas_page.parse_gas_prices()
+    return [(price['ref_id'], price['price'], datetime.strftime(price['dt'], '%Y-%m-%d %H:%M:%S'), task['city_id']) for price in gas_prices]
+
+def worker(worker_id=None, idle_seconds=10):
+    """
+    Claims, fetches, parses and commits city page tasks until the queue is empty.
+    Any number of workers can run at once, see WorkQueue for where they can run.
+
+    Parameters:
+    worker_id (str): A name unique to the worker, defaults to the host name and process id.
+    idle_seconds (int): How long to wait when every remaining task is leased to another worker.
+    """
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    queue = WorkQueue()
+    # A hung request must give up well before its lease runs out and the task is handed to another worker
+    fetch_timeout = queue.lease_seconds / 4
+    conn = sqlite3.connect('../gas.sqlite', timeout=30)
+    cursor = conn.cursor()
+    print(f'Worker {worker_id} started')
+    while True:
+        task = queue.claim(worker_id)
+        if task is None:
+            # Leases held by other workers may still expire if those workers crashed
+            if queue.remaining() == 0:
+                break
+            time.sleep(idle_seconds)
+            continue
+        try:
+            price_list = crawl_city(task, fetch_timeout)
+        except Exception as e:
+            print(f"Could not crawl city {task['city_id']}")
+            print(e)
+            queue.release(task['city_id'], worker_id)
+            continue
+        # Prices are keyed by ref_id, so a task crawled twice after a lease expiry is harmless
+        cursor.executemany('INSERT OR IGNORE INTO gas_prices VALUES (?, ?, ?, ?)', price_list)
+        conn.commit()
+        if not queue.complete(task['city_id'], worker_id):
+            print(f"Lease on city {task['city_id']} expired before it was completed")
+        print(f"City {task['city_id']} has {len(price_list)} prices")
+    conn.close()
+    print(f'Worker {worker_id} finished')
+
+if __name__ == "__main__":
+    # Usage: python crawl.py coordinator | python crawl.py worker [worker_id]
+    if len(sys.argv) > 1 and sys.argv[1] == 'coordinator':
+        coordinator()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        worker(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        print('Usage: python crawl.py coordinator | worker [worker_id]')
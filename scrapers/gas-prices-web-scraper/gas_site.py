@@ -4,6 +4,8 @@ from datetime import datetime, timedelta
 from urllib.parse import urljoin, quote
 
 class GasSite:
+    gasbuddy_image = 'https://images.gasbuddy.com/images/websites/gasbuddy/apps/download_gasbuddy_sm.png'
+
     def __init__(self, url):
         prefix = 'https://' if 'http' not in url else ''
         self.url = prefix + url
@@ -14,14 +16,46 @@ class GasSite:
         self.is_gasbuddy = True
         self.prices = []
 
-    def fetch_soup(self):
+    def fetch_soup(self, timeout=None):
         if not self.soup:
-            response = requests.get(self.url, headers=self.headers)
+            response = requests.get(self.url, headers=self.headers, timeout=timeout)
+            # An error page has no GasBuddy image, and must not be taken for a site that isn't GasBuddy
+            response.raise_for_status()
             soup = BeautifulSoup(response.text, 'html.parser')
-            gasbuddy_image = 'https://images.gasbuddy.com/images/websites/gasbuddy/apps/download_gasbuddy_sm.png'
-            self.is_gasbuddy = soup.find('img', src=gasbuddy_image) is not None
+            self.is_gasbuddy = soup.find('img', src=self.gasbuddy_image) is not None
             self.soup = soup
 
+    def probe_is_gasbuddy(self, max_bytes=262144, timeout=15):
+        """
+        Checks if the site is a GasBuddy site by streaming the page and stopping as soon as
+        the GasBuddy image shows up, without downloading or parsing the whole page.
+        Error responses raise, so they are never mistaken for a site that isn't GasBuddy.
+
+        Parameters:
+        max_bytes (int): The most bytes to read before giving up on the probe.
+        timeout (int): The request timeout in seconds.
+
+        Returns:
+        bool: Whether the site is a GasBuddy site, or None if the page was longer than max_bytes
+        without the image, in which case only the full page can tell.
+        """
+        marker = self.gasbuddy_image.encode()
+        content = b''
+        with requests.get(self.url, headers=self.headers, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=16384):
+                # Only search the new chunk plus enough of the previous bytes to catch a split marker
+                search_start = max(0, len(content) - len(marker))
+                content += chunk
+                if marker in content[search_start:]:
+                    self.is_gasbuddy = True
+                    return self.is_gasbuddy
+                if len(content) >= max_bytes:
+                    return None
+        # The whole page was read without finding the image
+        self.is_gasbuddy = False
+        return self.is_gasbuddy
+
     def parse_date(self, date_ref):
         # Example of date ref: Mon 12:30 PM
         today = datetime.today()
@@ -1,51 +1,131 @@
 from urllib.parse import urlparse
 import requests
 from bs4 import BeautifulSoup
-import pickle
+from gas_site import GasSite
+import threading
 
 class GasSiteLinks:
-    def __init__(self, us_site='https://www.fueleconomy.gov/feg/gasprices/states/index.shtml'):
+    def __init__(self, us_site='https://www.fueleconomy.gov/feg/gasprices/states/index.shtml', catalog=None):
         self.us_site = us_site
+        self.catalog = catalog
+        self.refresh_thread = None
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
         }
         self.us_links = None
         self.cad_links = None
 
-    def scrape_us_state_links(self):
-        print('Fetching US State Links')
+    def fetch_us_state_links(self):
         response = requests.get(self.us_site, headers=self.headers)
         soup = BeautifulSoup(response.text, 'html.parser')
-        self.us_links = []
+        us_links = []
         for area in soup.find_all('area'):
             href = area['href']
             alt = area['alt']
             link = f'https://www.fueleconomy.gov/feg/gasprices/states/{href}'
             state_code = href.split('.')[0]
-            self.us_links.append({'link': link, 'name': alt, 'state_code': state_code, 'area_links': []})
+            us_links.append({'link': link, 'name': alt, 'state_code': state_code, 'area_links': []})
+        return us_links
+
+    def scrape_us_state_links(self):
+        print('Fetching US State Links')
+        self.us_links = self.fetch_us_state_links()
 
     def scrape_us_area_links(self, us_state_dict):
         response = requests.get(us_state_dict['link'], headers=self.headers)
         soup = BeautifulSoup(response.text, 'html.parser')
         city_prices_div = soup.find('div', class_='row city-prices')
         area_links = [link['href'] for link in city_prices_div.find_all('a')] if city_prices_div else []
-        # Extract domain
-        area_links = [urlparse(link).netloc for link in area_links]
+        # Extract domain. Host names are case insensitive, and the state pages link the same host
+        # in different cases, so they are lower-cased here and every later lookup uses this value
+        area_links = [urlparse(link).netloc.lower() for link in area_links]
         # Make unique
         area_links = list(set(area_links))
         return area_links
     
     def get_us_links(self):
+        # Start from the catalog immediately if it has been filled, and re-verify it in the background
+        if self.us_links is None and self.catalog:
+            us_links = self.catalog.get_states()
+            if us_links:
+                print(f'Loaded {len(us_links)} US state links from catalog')
+                self.us_links = us_links
+                self.refresh_thread = threading.Thread(target=self.refresh_catalog)
+                self.refresh_thread.start()
+                return self.us_links
         if self.us_links is None:
             self.scrape_us_state_links()
         for state in self.us_links:
             print(f"Getting {state['name']} area links")
             state['area_links'] = self.scrape_us_area_links(state)
+        self.save_us_links()
         return self.us_links
 
-    def save_us_links(self, file_path):
-        with open(file_path, 'wb') as f:
-            pickle.dump(self.us_links, f)
+    def refresh_catalog(self):
+        """
+        Re-verifies the catalog entries which are due for a refresh. This runs on a background
+        thread while the crawl works from the catalog, call wait_for_refresh before exiting.
+        """
+        try:
+            self.refresh_us_links()
+        except Exception as e:
+            print('Could not refresh the US state links')
+            print(e)
+        # Cities of areas no state or province links to anymore would otherwise be refreshed forever
+        area_links = [area_link for state in self.catalog.get_states() + self.get_cad_links() for area_link in state['area_links']]
+        self.catalog.remove_cities_except(area_links)
+        self.refresh_city_links()
+
+    def refresh_us_links(self):
+        """
+        Re-scrapes the state list when it is due, adding new states and dropping removed ones,
+        then re-scrapes the area links of every state whose entries are due.
+        """
+        states = self.catalog.get_states()
+        us_links = self.fetch_us_state_links() if self.catalog.state_list_stale() else None
+        if us_links == []:
+            # An error or changed index page would otherwise wipe every state from the catalog
+            print('The US state index listed no states, keeping the catalog states')
+        elif us_links:
+            stale_codes = set(state['state_code'] for state in states if state['stale'])
+            known_codes = set(state['state_code'] for state in states)
+            # New states have no area links yet, so they are scraped along with the stale ones
+            states = [state for state in us_links if state['state_code'] in stale_codes or state['state_code'] not in known_codes]
+            self.catalog.remove_states_except([state['state_code'] for state in us_links])
+            # States which are still listed but not due keep their areas, only their state entry is re-verified
+            self.catalog.touch_states([state['state_code'] for state in us_links if state['state_code'] not in stale_codes])
+        for state in states:
+            if not state.get('stale', True):
+                continue
+            try:
+                state['area_links'] = self.scrape_us_area_links(state)
+                self.catalog.save_state(state)
+            except Exception as e:
+                print(f"Could not refresh {state['name']} area links")
+                print(e)
+
+    def refresh_city_links(self):
+        """
+        Re-discovers the city links of every area whose entries are due for a refresh,
+        and drops the cities of areas which are no longer GasBuddy sites.
+        """
+        for domain in self.catalog.get_stale_city_domains():
+            try:
+                gas_site = GasSite(domain)
+                gas_site.fetch_soup(timeout=15)
+                city_list = gas_site.get_city_list() if gas_site.is_gasbuddy else []
+                self.catalog.save_cities(domain, city_list)
+            except Exception as e:
+                print(f'Could not refresh {domain} city links')
+                print(e)
+
+    def wait_for_refresh(self):
+        if self.refresh_thread:
+            self.refresh_thread.join()
+
+    def save_us_links(self):
+        if self.catalog and self.us_links:
+            self.catalog.save_states(self.us_links)
 
     def get_cad_links(self):
         self.cad_links = [
@@ -61,6 +141,10 @@ class GasSiteLinks:
             {'link': '', 'city_links': ['http://www.newfoundlandgasprices.com/'], 'name': 'Newfoundland', 'state_code': 'NF'},
             {'link': '', 'city_links': ['http://www.novascotiagasprices.com/'], 'name': 'Nova Scotia', 'state_code': 'NS'}
         ]
+        # Each province is one area site, stored by domain like the US area links
+        for province in self.cad_links:
+            province['country'] = 'CAN'
+            province['area_links'] = [urlparse(link).netloc.lower() for link in province['city_links']]
         return self.cad_links
     
     def get_links(self):
@@ -72,7 +156,7 @@ class GasSiteLinks:
     gas_sites = GasSiteLinks('https://www.fueleconomy.gov/feg/gasprices/states/')
     us_sites = gas_sites.get_us_dict()
     print(us_sites)
-    gas_sites.save_us_links('./us_sites.pkl')"""
+    gas_sites.save_us_links()"""
 
     
 """
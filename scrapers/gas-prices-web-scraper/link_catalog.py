@@ -0,0 +1,268 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+class LinkCatalog:
+    """
+    A persistent catalog of the links used by the gas crawl, stored in SQLite.
+    Holds the states, the area domains of each state and the city urls of each area,
+    each with its own refresh policy so crawls can start from the catalog immediately.
+    """
+    VERSION = 1
+
+    def __init__(self, path='../link_catalog.sqlite', state_max_age=timedelta(days=30),
+                 area_max_age=timedelta(days=7), city_max_age=timedelta(days=7),
+                 gasbuddy_max_age=timedelta(days=30)):
+        self.path = path
+        self.max_ages = {
+            'states': state_max_age,
+            'areas': area_max_age,
+            'cities': city_max_age,
+            'gasbuddy_checks': gasbuddy_max_age,
+        }
+        self.check_tables_exist()
+
+    def connect(self):
+        # Each call opens its own connection so the catalog can be used from a background thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def check_tables_exist(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.VERSION:
+            # The catalog is only a cache of links, so an incompatible version is dropped and rebuilt.
+            # New tables don't need a new version, CREATE TABLE IF NOT EXISTS adds them
+            cursor.execute('DROP TABLE IF EXISTS states')
+            cursor.execute('DROP TABLE IF EXISTS areas')
+            cursor.execute('DROP TABLE IF EXISTS cities')
+            cursor.execute('DROP TABLE IF EXISTS gasbuddy_checks')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS states (
+                state_code TEXT PRIMARY KEY,
+                name TEXT,
+                link TEXT,
+                verified_at TEXT,
+                refresh_after INTEGER
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS areas (
+                domain TEXT,
+                state_code TEXT,
+                verified_at TEXT,
+                refresh_after INTEGER,
+                PRIMARY KEY (domain, state_code)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cities (
+                url TEXT PRIMARY KEY,
+                domain TEXT,
+                identifier TEXT,
+                name TEXT,
+                verified_at TEXT,
+                refresh_after INTEGER
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS gasbuddy_checks (
+                domain TEXT PRIMARY KEY,
+                is_gasbuddy INTEGER,
+                verified_at TEXT,
+                refresh_after INTEGER
+            )
+        ''')
+        cursor.execute(f'PRAGMA user_version = {self.VERSION}')
+        conn.commit()
+        conn.close()
+
+    def entry_policy(self, kind):
+        verified_at = datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')
+        refresh_after = int(self.max_ages[kind].total_seconds())
+        return verified_at, refresh_after
+
+    def is_stale(self, verified_at, refresh_after):
+        verified_at = datetime.strptime(verified_at, '%Y-%m-%d %H:%M:%S')
+        return datetime.now() > verified_at + timedelta(seconds=refresh_after)
+
+    def save_state(self, state):
+        """
+        Saves a state and its area domains, replacing the areas previously stored for it.
+
+        Parameters:
+        state (dict): A state dictionary as built by GasSiteLinks.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        verified_at, refresh_after = self.entry_policy('states')
+        cursor.execute('INSERT OR REPLACE INTO states VALUES (?, ?, ?, ?, ?)',
+                       (state['state_code'], state['name'], state['link'], verified_at, refresh_after))
+        cursor.execute('DELETE FROM areas WHERE state_code=?', (state['state_code'],))
+        verified_at, refresh_after = self.entry_policy('areas')
+        cursor.executemany('INSERT OR REPLACE INTO areas VALUES (?, ?, ?, ?)',
+                           [(domain, state['state_code'], verified_at, refresh_after) for domain in state['area_links']])
+        conn.commit()
+        conn.close()
+
+    def save_states(self, states):
+        for state in states:
+            self.save_state(state)
+
+    def touch_states(self, state_codes):
+        """
+        Marks the state entries as verified again, without changing their areas.
+        """
+        conn = self.connect()
+        verified_at, refresh_after = self.entry_policy('states')
+        conn.executemany('UPDATE states SET verified_at=?, refresh_after=? WHERE state_code=?',
+                         [(verified_at, refresh_after, state_code) for state_code in state_codes])
+        conn.commit()
+        conn.close()
+
+    def remove_states_except(self, state_codes):
+        """
+        Removes the states, and their areas, which are no longer in the given list.
+        An empty list is ignored rather than emptying the catalog.
+        """
+        if not state_codes:
+            return
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT state_code FROM states')
+        state_codes = set(state_codes)
+        removed = [(row[0],) for row in cursor.fetchall() if row[0] not in state_codes]
+        cursor.executemany('DELETE FROM states WHERE state_code=?', removed)
+        cursor.executemany('DELETE FROM areas WHERE state_code=?', removed)
+        conn.commit()
+        conn.close()
+
+    def remove_cities_except(self, domains):
+        """
+        Removes the cities of areas which are not in the given list of area domains.
+        An empty list is ignored rather than emptying the catalog.
+        """
+        if not domains:
+            return
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT domain FROM cities')
+        domains = set(domains)
+        removed = [(row[0],) for row in cursor.fetchall() if row[0] not in domains]
+        cursor.executemany('DELETE FROM cities WHERE domain=?', removed)
+        conn.commit()
+        conn.close()
+
+    def state_list_stale(self):
+        conn = self.connect()
+        rows = conn.execute('SELECT verified_at, refresh_after FROM states').fetchall()
+        conn.close()
+        return any(self.is_stale(verified_at, refresh_after) for verified_at, refresh_after in rows)
+
+    def get_states(self):
+        """
+        Returns the stored states in the same shape as GasSiteLinks.get_us_links.
+
+        Returns:
+        list: A list of state dictionaries, each with a 'stale' flag.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT state_code, name, link, verified_at, refresh_after FROM states ORDER BY name')
+        states = []
+        for state_code, name, link, verified_at, refresh_after in cursor.fetchall():
+            cursor.execute('SELECT domain, verified_at, refresh_after FROM areas WHERE state_code=?', (state_code,))
+            areas = cursor.fetchall()
+            stale = self.is_stale(verified_at, refresh_after) or any(self.is_stale(a[1], a[2]) for a in areas)
+            states.append({
+                'link': link,
+                'name': name,
+                'state_code': state_code,
+                # Older entries may hold mixed case domains, which are the same hosts
+                'area_links': sorted(set(area[0].lower() for area in areas)),
+                'stale': stale
+            })
+        conn.close()
+        return states
+
+    def save_cities(self, domain, city_list):
+        """
+        Saves the city urls discovered on an area's site, replacing the ones previously stored for it.
+
+        Parameters:
+        domain (str): The area's domain.
+        city_list (list): A list of city dictionaries as returned by GasSite.get_city_list.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        verified_at, refresh_after = self.entry_policy('cities')
+        cursor.execute('DELETE FROM cities WHERE domain=?', (domain,))
+        cursor.executemany('INSERT OR REPLACE INTO cities VALUES (?, ?, ?, ?, ?, ?)',
+                           [(city['url'], domain, city['identifier'], city['name'], verified_at, refresh_after)
+                            for city in city_list])
+        conn.commit()
+        conn.close()
+
+    def get_cities(self, domain, include_stale=False):
+        """
+        Returns the stored city urls of an area.
+
+        Parameters:
+        domain (str): The area's domain.
+        include_stale (bool): Whether to return cities which are due for a refresh.
+
+        Returns:
+        list: A list of city dictionaries, or None if the area has no usable entries.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT url, identifier, name, verified_at, refresh_after FROM cities WHERE domain=?', (domain,))
+        rows = cursor.fetchall()
+        conn.close()
+        if not rows:
+            return None
+        if not include_stale and any(self.is_stale(row[3], row[4]) for row in rows):
+            return None
+        return [{'identifier': identifier, 'name': name, 'url': url} for url, identifier, name, _, _ in rows]
+
+    def get_stale_city_domains(self):
+        """
+        Returns the area domains which have city entries due for a refresh.
+        """
+        conn = self.connect()
+        rows = conn.execute('SELECT domain, verified_at, refresh_after FROM cities').fetchall()
+        conn.close()
+        return sorted(set(domain for domain, verified_at, refresh_after in rows if self.is_stale(verified_at, refresh_after)))
+
+    def save_gasbuddy_checks(self, verdicts):
+        """
+        Saves whether each area domain is a GasBuddy site.
+
+        Parameters:
+        verdicts (dict): A dictionary of domain to is_gasbuddy.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        verified_at, refresh_after = self.entry_policy('gasbuddy_checks')
+        cursor.executemany('INSERT OR REPLACE INTO gasbuddy_checks VALUES (?, ?, ?, ?)',
+                           [(domain, int(is_gasbuddy), verified_at, refresh_after) for domain, is_gasbuddy in verdicts.items()])
+        conn.commit()
+        conn.close()
+
+    def get_gasbuddy_checks(self, domains):
+        """
+        Returns the unexpired GasBuddy verdicts of the given domains.
+
+        Parameters:
+        domains (list): A list of area domains.
+
+        Returns:
+        dict: A dictionary of domain to is_gasbuddy, missing any domain without a usable verdict.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT domain, is_gasbuddy, verified_at, refresh_after FROM gasbuddy_checks')
+        rows = cursor.fetchall()
+        conn.close()
+        domains = set(domains)
+        return {domain: bool(is_gasbuddy) for domain, is_gasbuddy, verified_at, refresh_after in rows
+                if domain in domains and not self.is_stale(verified_at, refresh_after)}
@@ -1,7 +1,9 @@
 from gas_site_links import GasSiteLinks
 from gas_site import GasSite
+from link_catalog import LinkCatalog
 import sqlite3
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 def check_tables_exist():
     conn = sqlite3.connect('../gas.sqlite')
@@ -49,58 +51,142 @@ def check_tables_exist():
 
     conn.close()
 
-def main():
-    gas_site_links = GasSiteLinks()
+def check_domain(domain, probe):
+    """
+    Checks if an area domain is a GasBuddy site, and lists its cities whenever the full page was fetched.
+
+    Parameters:
+    domain (str): The area's domain.
+    probe (bool): Whether to try the cheap probe first. Areas without cached cities skip it,
+    as their full page is needed for the city list anyway.
+
+    Returns:
+    tuple: Whether the site is a GasBuddy site, or None if the check failed, and the city list,
+    or None if the full page wasn't fetched or isn't GasBuddy.
+    """
+    try:
+        gas_site = GasSite(domain)
+        if probe:
+            is_gasbuddy = gas_site.probe_is_gasbuddy()
+            if is_gasbuddy is not None:
+                return is_gasbuddy, None
+        # Either no probe, or the image wasn't in the first bytes of a long page, so the full page decides
+        gas_site.fetch_soup(timeout=15)
+        city_list = gas_site.get_city_list() if gas_site.is_gasbuddy else None
+        return gas_site.is_gasbuddy, city_list
+    except Exception as e:
+        print(f'Could not probe {domain}')
+        print(e)
+        return None, None
+
+def discover_gasbuddy_areas(na_array, catalog, max_workers=8):
+    """
+    Finds which area domains across all states are GasBuddy sites. Each domain is only checked once,
+    verdicts are read from the catalog while they are fresh, and the rest are checked concurrently.
+    Areas with cached cities get the cheap probe, the others are fetched in full once and their
+    city lists saved to the catalog, so discover_cities doesn't fetch them again.
+
+    Parameters:
+    na_array (list): A list of state dictionaries.
+    catalog (LinkCatalog): The catalog caching the verdicts.
+    max_workers (int): How many domains to probe at once.
+
+    Returns:
+    set: The GasBuddy area domains.
+    """
+    domains = list(set(area_link for state in na_array for area_link in state.get('area_links', [])))
+    verdicts = catalog.get_gasbuddy_checks(domains)
+    unchecked = [domain for domain in domains if domain not in verdicts]
+    probes = [catalog.get_cities(domain, include_stale=True) is not None for domain in unchecked]
+    print(f'{len(domains)} unique areas, checking {len(unchecked)}')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        checked = dict(zip(unchecked, executor.map(check_domain, unchecked, probes)))
+    for domain, (is_gasbuddy, city_list) in checked.items():
+        if city_list is not None:
+            catalog.save_cities(domain, city_list)
+    # Failed probes are left out of the cache so they are retried on the next run
+    probed = {domain: is_gasbuddy for domain, (is_gasbuddy, _) in checked.items() if is_gasbuddy is not None}
+    catalog.save_gasbuddy_checks(probed)
+    verdicts.update(probed)
+    return set(domain for domain, is_gasbuddy in verdicts.items() if is_gasbuddy)
+
+def discover_cities(catalog=None):
+    """
+    Fills the states and cities tables for every state and province, without crawling any prices.
+    """
+    catalog = catalog or LinkCatalog()
+    gas_site_links = GasSiteLinks(catalog=catalog)
     na_array = gas_site_links.get_links()
+    gasbuddy_areas = discover_gasbuddy_areas(na_array, catalog)
     check_tables_exist()
 
     conn = sqlite3.connect('../gas.sqlite')
     cursor = conn.cursor()
 
-    for state in na_array[:4]:
+    for state in na_array:
         # Get the current state's state id
         cursor.execute("SELECT id FROM states WHERE name=?", (state['name'],))
         state_id = cursor.fetchone()
         if state_id:
             state_id = state_id[0]
         else:
-            cursor.execute("INSERT INTO states VALUES (NULL, 'USA', ?, ?)", (state['name'], state['state_code']))
+            cursor.execute("INSERT INTO states VALUES (NULL, ?, ?, ?)", (state.get('country', 'USA'), state['name'], state['state_code']))
             conn.commit()
             state_id = cursor.lastrowid
         
         print(f"State: {state['name']}, {state_id}")
         # Loop the areas in the state
-        for area_link in state['area_links']:
-            gas_site = GasSite(area_link)
-            gas_site.fetch_soup()
-            if not gas_site.is_gasbuddy:
+        for area_link in state.get('area_links', []):
+            if area_link not in gasbuddy_areas:
                 print('Not a Gasbuddy site')
                 continue
-            # Get the cities in that area's site and loop them
-            city_list = gas_site.get_city_list()
+            # Get the cities in that area's site from the catalog, or discover them and loop them.
+            # Stale entries are still used, the catalog re-verifies them in the background
+            city_list = catalog.get_cities(area_link, include_stale=True)
+            if city_list is None:
+                gas_site = GasSite(area_link)
+                gas_site.fetch_soup()
+                if not gas_site.is_gasbuddy:
+                    print('Not a Gasbuddy site')
+                    continue
+                city_list = gas_site.get_city_list()
+                catalog.save_cities(area_link, city_list)
             for city in city_list:
                 if city['name'] == 'All Areas':
                     continue
-                # Get the city's id
                 cursor.execute("SELECT id FROM cities WHERE identifier=?", (city['identifier'],))
-                city_id = cursor.fetchone()
-                if city_id:
-                    city_id = city_id[0]
-                else:
+                if cursor.fetchone() is None:
                     cursor.execute("INSERT INTO cities (name, identifier, url, state_id) VALUES (?, ?, ?, ?)", 
                                 (city['name'], city['identifier'], city['url'], state_id))
-                    conn.commit()
-                    city_id = cursor.lastrowid
-                # Parse the city's gas page as its own site, and get its gas prices
-                city_gas_page = GasSite(city['url'])
-                city_gas_page.fetch_soup()
-                gas_prices = city_gas_page.parse_gas_prices()
-                print(f"City Name: {city['name']}, {city_id}, has {len(gas_prices)} prices")
-                price_list = [(price['ref_id'], price['price'], datetime.strftime(price['dt'], '%Y-%m-%d %H:%M:%S'), city_id) for price in gas_prices]
-                cursor.executemany('INSERT OR IGNORE INTO gas_prices VALUES (?, ?, ?, ?)', price_list)
+            print(f"Area: {area_link}, {len(city_list)} cities")
         conn.commit()
 
     conn.close()
+    gas_site_links.wait_for_refresh()
+
+def crawl_cities():
+    """
+    Crawls the gas prices of every city in the cities table, one at a time.
+    For several workers, use crawl.py instead.
+    """
+    conn = sqlite3.connect('../gas.sqlite')
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name, url FROM cities WHERE name != 'All Areas'")
+    for city_id, name, url in cursor.fetchall():
+        # Parse the city's gas page as its own site, and get its gas prices
+        city_gas_page = GasSite(url)
+        city_gas_page.fetch_soup()
+        gas_prices = city_gas_page.parse_gas_prices()
+        print(f"City Name: {name}, {city_id}, has {len(gas_prices)} prices")
+        price_list = [(price['ref_id'], price['price'], datetime.strftime(price['dt'], '%Y-%m-%d %H:%M:%S'), city_id) for price in gas_prices]
+        cursor.executemany('INSERT OR IGNORE INTO gas_prices VALUES (?, ?, ?, ?)', price_list)
+        conn.commit()
+
+    conn.close()
+
+def main():
+    discover_cities()
+    crawl_cities()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
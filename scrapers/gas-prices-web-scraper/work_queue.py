@@ -0,0 +1,123 @@
+import sqlite3
+import time
+
+class WorkQueue:
+    """
+    A lease based work queue of city page tasks, stored in SQLite next to the crawl's tables.
+    Workers claim a task for a lease period, and a task whose lease runs out without being
+    completed, because its worker crashed, can be claimed again by another worker.
+
+    Claims rely on SQLite's file locks, using the default rollback journal. Workers can be separate
+    processes on one host, or on several hosts only if they share the database on a filesystem with
+    working POSIX advisory locks. Most network filesystems, NFS and SMB included, don't lock reliably
+    and can hand one task to two workers or corrupt the database.
+    """
+    def __init__(self, path='../gas.sqlite', lease_seconds=300, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.check_tables_exist()
+
+    def connect(self):
+        # Autocommit mode so claims can take the write lock with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def check_tables_exist(self):
+        conn = self.connect()
+        # WAL mode sticks to the database file, so a database switched to it earlier is switched back
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_tasks (
+                city_id INTEGER PRIMARY KEY,
+                url TEXT,
+                status TEXT,
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER
+            )
+        ''')
+        conn.close()
+
+    def enqueue_cities(self):
+        """
+        Writes a task for every city in the cities table. Cities already finished or failed
+        are queued again for a new crawl, tasks still pending or leased are left alone.
+
+        Returns:
+        int: The number of tasks now waiting to be claimed.
+        """
+        conn = self.connect()
+        conn.execute('''
+            INSERT INTO crawl_tasks (city_id, url, status, lease_owner, lease_expires, attempts)
+            SELECT id, url, 'pending', NULL, NULL, 0 FROM cities WHERE name != 'All Areas'
+            ON CONFLICT(city_id) DO UPDATE SET
+                url=excluded.url, status='pending', lease_owner=NULL, lease_expires=NULL, attempts=0
+            WHERE status IN ('done', 'failed')
+        ''')
+        pending = conn.execute("SELECT COUNT(*) FROM crawl_tasks WHERE status='pending'").fetchone()[0]
+        conn.close()
+        return pending
+
+    def claim(self, worker_id):
+        """
+        Leases the next available task to a worker.
+
+        Parameters:
+        worker_id (str): A name unique to the worker.
+
+        Returns:
+        dict: The task's city_id and url, or None if there is nothing to claim.
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Tasks whose workers keep crashing are given up on
+            conn.execute("UPDATE crawl_tasks SET status='failed' WHERE status='leased' AND lease_expires < ? AND attempts >= ?",
+                         (now, self.max_attempts))
+            row = conn.execute('''
+                SELECT city_id, url FROM crawl_tasks
+                WHERE status='pending' OR (status='leased' AND lease_expires < ?)
+                ORDER BY attempts, city_id LIMIT 1
+            ''', (now,)).fetchone()
+            if row:
+                conn.execute('''
+                    UPDATE crawl_tasks SET status='leased', lease_owner=?, lease_expires=?, attempts=attempts + 1
+                    WHERE city_id=?
+                ''', (worker_id, now + self.lease_seconds, row[0]))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return {'city_id': row[0], 'url': row[1]} if row else None
+
+    def finish(self, city_id, worker_id, status):
+        # Only the current lease holder can finish a task, a worker whose lease expired loses it
+        conn = self.connect()
+        cursor = conn.execute("UPDATE crawl_tasks SET status=?, lease_owner=NULL, lease_expires=NULL WHERE city_id=? AND lease_owner=? AND status='leased'",
+                              (status, city_id, worker_id))
+        conn.close()
+        return cursor.rowcount == 1
+
+    def complete(self, city_id, worker_id):
+        return self.finish(city_id, worker_id, 'done')
+
+    def release(self, city_id, worker_id):
+        """
+        Puts a task that failed back in the queue, or marks it failed once it is out of attempts.
+        """
+        conn = self.connect()
+        conn.execute('''
+            UPDATE crawl_tasks SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                lease_owner=NULL, lease_expires=NULL
+            WHERE city_id=? AND lease_owner=? AND status='leased'
+        ''', (self.max_attempts, city_id, worker_id))
+        conn.close()
+
+    def remaining(self):
+        conn = self.connect()
+        count = conn.execute("SELECT COUNT(*) FROM crawl_tasks WHERE status IN ('pending', 'leased')").fetchone()[0]
+        conn.close()
+        return count
@@ -2,6 +2,7 @@ import requests
 from bs4 import BeautifulSoup
 import xml.etree.ElementTree as ET
 from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image
 import base64
@@ -11,6 +12,24 @@ import os
 load_dotenv()
 from pprint import pprint
 
+FEG_REST_URL = 'https://www.fueleconomy.gov/ws/rest'
+
+# The REST API names some fuels and transmissions differently from the PowerSearch pages
+REST_FUEL_NAMES = {
+    'Regular': 'Regular Gasoline',
+    'Midgrade': 'Midgrade Gasoline',
+    'Premium': 'Premium Gasoline',
+}
+# Plug-in hybrids list both fuels, eg 'Premium and Electricity' or 'Regular Gas or Electricity'
+REST_FUEL_GRADES = {
+    'Regular Gas': 'Regular Gasoline',
+    'Premium Gas': 'Premium Gasoline',
+    **REST_FUEL_NAMES,
+}
+REST_TRANSMISSION_PREFIXES = {
+    'Automatic': 'Auto',
+}
+
 def get_base_64_img(url):
     image_base64 = None
     try:
@@ -23,14 +42,17 @@ def get_base_64_img(url):
         print(e)
     return image_base64
 
-def get_years():
+def get_years(base_url=FEG_REST_URL):
     """
     Fetches a list of available years from the fueleconomy.gov API.
 
+    Args:
+        base_url (str): The root of the REST API, can be pointed at a local stub server.
+
     Returns:
         list: A list of integers representing the available years.
     """
-    url = "https://www.fueleconomy.gov/ws/rest/vehicle/menu/year"
+    url = f"{base_url}/vehicle/menu/year"
     response = requests.get(url)
     # Check if the request was successful
     if response.status_code != 200:
@@ -193,6 +215,157 @@ def get_car_data(make, model, year):
         return []
 
 
+def get_rest_menu(path, params, base_url=FEG_REST_URL):
+    """
+    Fetches a menu from the fueleconomy.gov REST API.
+
+    Args:
+        path (str): The menu path, eg 'vehicle/menu/model'.
+        params (dict): The query parameters for the menu.
+        base_url (str): The root of the REST API, can be pointed at a local stub server.
+
+    Returns:
+        list: A list of dictionaries containing the text and value of each menu item.
+    """
+    response = requests.get(f'{base_url}/{path}', params=params)
+    if response.status_code != 200:
+        raise ValueError(f'Failed to fetch {path}')
+    root = ET.fromstring(response.content)
+    return [{
+        'text': menuItem.findtext('text'),
+        'value': menuItem.findtext('value')
+        } for menuItem in root.findall('.//menuItem')]
+
+def get_rest_vehicle(vehicle_id, base_url=FEG_REST_URL):
+    """
+    Fetches a single vehicle record from the fueleconomy.gov REST API.
+
+    Args:
+        vehicle_id (str): The fueleconomy.gov id of the vehicle.
+        base_url (str): The root of the REST API.
+
+    Returns:
+        xml.etree.ElementTree.Element: The vehicle element, or None if it could not be fetched.
+    """
+    try:
+        response = requests.get(f'{base_url}/vehicle/{vehicle_id}')
+        if response.status_code != 200:
+            print(f'Failed to fetch vehicle {vehicle_id}')
+            return None
+        return ET.fromstring(response.content)
+    except Exception as e:
+        print(f'Error fetching vehicle {vehicle_id}')
+        print(e)
+        return None
+
+def parse_rest_vehicle(vehicle, make, model, year):
+    """
+    Maps a fueleconomy.gov REST vehicle record to the same document shape as get_car_data.
+    The model is the record's base model, as PowerSearch searches by base model, and the full
+    model name goes in the name. Known fuel and transmission names are mapped to their PowerSearch
+    spelling, others are kept as the REST API writes them.
+
+    Args:
+        vehicle (xml.etree.ElementTree.Element): The vehicle element.
+        make (str): The make of the vehicle.
+        model (str): The model the vehicle was listed under, used if the record has no base model.
+        year (int): The year of the vehicle.
+
+    Returns:
+        dict: The car data.
+    """
+    def to_int(tag):
+        value = vehicle.findtext(tag)
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return ''
+
+    # Build the trim in the same format as the PowerSearch page, eg "Auto (AV-S7), 4 cyl, 1.5 L, Turbo"
+    transmission = vehicle.findtext('trany') or ''
+    for rest_prefix, prefix in REST_TRANSMISSION_PREFIXES.items():
+        if transmission.startswith(rest_prefix):
+            transmission = prefix + transmission[len(rest_prefix):]
+    trim_parts = [transmission]
+    cylinders = vehicle.findtext('cylinders')
+    displ = vehicle.findtext('displ')
+    if cylinders:
+        trim_parts.append(f'{cylinders} cyl')
+    if displ:
+        trim_parts.append(f'{displ} L')
+    if vehicle.findtext('tCharger') == 'T':
+        trim_parts.append('Turbo')
+    if vehicle.findtext('sCharger') == 'S':
+        trim_parts.append('Supercharger')
+    trim = ', '.join([part.strip() for part in trim_parts if part])
+
+    # Only electric vehicles report their economy in MPGe. A plug-in hybrid's comb08, city08 and
+    # highway08 are its gasoline figures, its electric MPGe is in the *A08 fields
+    atv_type = vehicle.findtext('atvType') or ''
+    units = 'MPGe' if atv_type == 'EV' else 'MPG'
+    fuel = vehicle.findtext('fuelType') or ''
+    for joiner in (' and ', ' or '):
+        grade, found, second_fuel = fuel.partition(joiner)
+        if found and grade in REST_FUEL_GRADES:
+            fuel = REST_FUEL_GRADES[grade] + joiner + second_fuel
+            break
+    else:
+        fuel = REST_FUEL_NAMES.get(fuel, fuel)
+    vehicle_range = to_int('range')
+    total_range = f'{vehicle_range} miles' if vehicle_range else None
+
+    return {
+        "year": year,
+        "make": make,
+        "model": vehicle.findtext('baseModel') or model,
+        "name": ' '.join([str(year), vehicle.findtext('make') or make, vehicle.findtext('model') or model]),
+        "trim": trim,
+        "fuel": fuel,
+        "units": units,
+        "total_range": total_range,
+        "fuel_economy": {
+            "combined": to_int('comb08'),
+            "city": to_int('city08'),
+            "hwy": to_int('highway08'),
+        },
+        # The REST API does not serve vehicle photos
+        "img": None
+    }
+
+def get_car_data_rest(make, model, year, base_url=FEG_REST_URL, batch_size=20):
+    """
+    Fetches car data for a given make, model, and year from the structured fueleconomy.gov REST API.
+    Returns the same document shape as get_car_data, without scraping the PowerSearch HTML.
+
+    Args:
+        make (str): The make of the vehicle.
+        model (str): The model of the vehicle.
+        year (int): The year of the vehicle.
+        base_url (str): The root of the REST API.
+        batch_size (int): How many vehicle records to fetch concurrently.
+
+    Returns:
+        list: A list of dictionaries containing the car data.
+    """
+    try:
+        options = get_rest_menu('vehicle/menu/options', {'year': year, 'make': make, 'model': model}, base_url)
+        vehicle_ids = [option['value'] for option in options]
+        car_mpg_list = []
+        with ThreadPoolExecutor(max_workers=batch_size) as executor:
+            for i in range(0, len(vehicle_ids), batch_size):
+                batch = vehicle_ids[i:i + batch_size]
+                vehicles = executor.map(lambda vehicle_id: get_rest_vehicle(vehicle_id, base_url), batch)
+                for vehicle in vehicles:
+                    if vehicle is None:
+                        continue
+                    car_mpg_list.append(parse_rest_vehicle(vehicle, make, model, year))
+        return car_mpg_list
+    except Exception as e:
+        print(e)
+        print(f'Error with {make} {model}, {year}')
+        return []
+
+
 def get_image(year, make, model):
     """
     Fetches an image for a given year, make, and model from the Google API, resizes it to a uniform size, and saves it to a file.
@@ -297,17 +470,33 @@ def insert_new_car_data(year, cars):
     client.close()
     print('Insert Complete')
 
-def get_all_makes_models_years():
+def get_all_makes_models_years(source='html', base_url=FEG_REST_URL):
+    """
+    Fetches the car data for every year, make and model and inserts it into MongoDB.
+
+    Args:
+        source (str): 'html' to scrape the PowerSearch pages, or 'rest' to use the structured REST API.
+        base_url (str): The root of the REST API, can be pointed at a local stub server.
+    """
     print('Starting Search')
-    years = get_years()
+    years = get_years(base_url)
     years = years[:1]
     for year in years:
         cars_in_year = []
-        makes = get_makes(year, year)
+        if source == 'rest':
+            makes = [item['value'] for item in get_rest_menu('vehicle/menu/make', {'year': year}, base_url)]
+        else:
+            makes = get_makes(year, year)
         for make in makes[:1]:
-            models = get_models(year, year, make)
+            if source == 'rest':
+                models = [item['value'] for item in get_rest_menu('vehicle/menu/model', {'year': year, 'make': make}, base_url)]
+            else:
+                models = get_models(year, year, make)
             for model in models:
-                car_data = get_car_data(make, model, year)
+                if source == 'rest':
+                    car_data = get_car_data_rest(make, model, year, base_url)
+                else:
+                    car_data = get_car_data(make, model, year)
                 cars_in_year += car_data
                 print(f'{year} {make} {model} - {len(car_data)} trims')
         print()
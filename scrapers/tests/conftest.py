@@ -0,0 +1,6 @@
+import os
+import sys
+
+scrapers_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, scrapers_dir)
+sys.path.insert(0, os.path.join(scrapers_dir, 'gas-prices-web-scraper'))
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import forex_web_scraper
+from forex_web_scraper import (FixtureQuoteSource, CentralChartsSource, OpenExchangeRatesSource, ECBSource, fetch_all_sources, merge_quotes, get_quotes,
+                               get_usd_rates, get_pair_price)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+OLD = datetime(2026, 1, 1, tzinfo=timezone.utc)
+NEW = datetime(2026, 1, 2, tzinfo=timezone.utc)
+
+def fixture(name, rates, **kwargs):
+    return FixtureQuoteSource(name, [{'base': 'USD', 'quote': quote, 'price': price} for quote, price in rates.items()], **kwargs)
+
+def by_currency(quotes):
+    return {quote_info['quote']: quote_info for quote_info in quotes}
+
+def test_fixture_inverts_non_usd_quotes():
+    quotes = FixtureQuoteSource('a', [{'base': 'GBP', 'quote': 'USD', 'price': 1.25}]).fetch(1)
+    assert quotes[0]['base'] == 'USD'
+    assert quotes[0]['quote'] == 'GBP'
+    assert quotes[0]['price'] == 0.8
+    assert quotes[0]['quote_time'] is None
+
+def test_merge_prefers_freshest_quote_and_treats_undated_as_oldest():
+    undated = fixture('undated', {'EUR': 0.91, 'CHF': 0.8}).fetch(1)
+    old = fixture('old', {'EUR': 0.9}, quote_time=OLD).fetch(1)
+    new = fixture('new', {'EUR': 0.92}, quote_time=NEW).fetch(1)
+    merged = by_currency(merge_quotes([undated, old, new]))
+    assert merged['EUR']['source'] == 'new'
+    assert merged['CHF']['source'] == 'undated'
+
+def test_merge_breaks_ties_by_source_order():
+    first = fixture('first', {'EUR': 0.9}, quote_time=OLD).fetch(1)
+    second = fixture('second', {'EUR': 0.91}, quote_time=OLD).fetch(1)
+    assert merge_quotes([first, second])[0]['source'] == 'first'
+    assert merge_quotes([second, first])[0]['source'] == 'second'
+
+def test_outlier_falls_back_to_consistent_source():
+    sources = [
+        fixture('a', {'EUR': 0.9, 'JPY': 165, 'GBP': 0.8}, quote_time=NEW),
+        fixture('b', {'EUR': 0.901, 'JPY': 150, 'GBP': 0.8}, quote_time=OLD),
+        fixture('c', {'EUR': 0.899, 'JPY': 150.2, 'CAD': 1.37}),
+    ]
+    quotes = by_currency(get_quotes(sources, deadline=5))
+    assert quotes['JPY']['source'] == 'b'
+    assert quotes['JPY']['price'] == 150
+    assert not any(quote_info['outlier'] for quote_info in quotes.values())
+
+def test_outlier_fallback_breaks_ties_by_source_order():
+    sources = [
+        fixture('a', {'EUR': 0.9, 'JPY': 165, 'GBP': 0.8}, quote_time=NEW),
+        fixture('b', {'EUR': 0.901, 'JPY': 150, 'GBP': 0.8}, quote_time=OLD),
+        fixture('c', {'EUR': 0.899, 'JPY': 150.2, 'GBP': 0.8}, quote_time=OLD),
+    ]
+    quotes = by_currency(get_quotes(sources, deadline=5))
+    assert quotes['JPY']['source'] == 'b'
+    assert not quotes['JPY']['outlier']
+
+def test_outlier_without_agreeing_source_is_flagged():
+    sources = [
+        fixture('a', {'EUR': 0.9, 'JPY': 190, 'GBP': 0.8}, quote_time=NEW),
+        fixture('b', {'EUR': 0.9, 'JPY': 150, 'GBP': 0.8}),
+    ]
+    quotes = by_currency(get_quotes(sources, deadline=5))
+    assert quotes['JPY']['outlier']
+    assert not quotes['EUR']['outlier']
+
+def test_fetch_all_sources_stops_at_deadline():
+    sources = [fixture('fast', {'EUR': 0.9}), fixture('slow', {'CHF': 0.8}, delay=5)]
+    start = time.monotonic()
+    quote_lists = fetch_all_sources(sources, deadline=0.5)
+    assert time.monotonic() - start < 2
+    assert len(quote_lists[0]) == 1
+    assert quote_lists[1] == []
+
+def test_main_skips_inserts_without_quotes(monkeypatch):
+    def insert(quotes):
+        raise AssertionError('nothing should be inserted')
+    # A source whose payload is missing fails like a site which is down
+    monkeypatch.setattr(forex_web_scraper, 'get_sources', lambda: [FixtureQuoteSource('down', path=os.path.join(FIXTURES, 'missing.json'))])
+    monkeypatch.setattr(forex_web_scraper, 'insert_raw_forex_mongodb', insert)
+    monkeypatch.setattr(forex_web_scraper, 'insert_forex_quotes_mongodb', insert)
+    forex_web_scraper.main()
+
+def test_get_pair_price_uses_usd_rates():
+    quotes = fixture('a', {'EUR': 0.8, 'JPY': 160}).fetch(1)
+    usd_rates = get_usd_rates(quotes)
+    assert get_pair_price(usd_rates, 'EUR', 'JPY') == 200
+    assert get_pair_price(usd_rates, 'USD', 'EUR') == 0.8
+    assert get_pair_price(usd_rates, 'EUR', 'XXX') == 0
+    assert len(quotes) == 2
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = os.path.join(FIXTURES, self.path.lstrip('/'))
+        if not os.path.isfile(path):
+            self.send_response(404)
+            self.end_headers()
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def base_url():
+    server = HTTPServer(('127.0.0.1', 0), FixtureHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+def rates(quotes):
+    assert all(quote_info['base'] == 'USD' for quote_info in quotes)
+    return {quote_info['quote']: quote_info['price'] for quote_info in quotes}
+
+def test_centralcharts_source(base_url):
+    source = CentralChartsSource()
+    source.url = f'{base_url}/centralcharts.html'
+    quotes = source.fetch(5)
+    assert rates(quotes) == {'EUR': 0.8, 'JPY': 150, 'IDR': 16000}
+    assert all(quote_info['quote_time'] is None for quote_info in quotes)
+    assert all(quote_info['source'] == 'centralcharts' for quote_info in quotes)
+
+def test_open_er_api_source(base_url):
+    source = OpenExchangeRatesSource()
+    source.url = f'{base_url}/open_er_api.json'
+    quotes = source.fetch(5)
+    assert rates(quotes) == {'EUR': 0.8, 'JPY': 150, 'GBP': 0.75}
+    assert quotes[0]['quote_time'] == datetime(2026, 1, 1, 0, 0, 1, tzinfo=timezone.utc)
+
+def test_ecb_source_triangulates_through_usd(base_url):
+    source = ECBSource()
+    source.url = f'{base_url}/ecb.xml'
+    quotes = source.fetch(5)
+    assert rates(quotes) == pytest.approx({'EUR': 0.8, 'JPY': 150, 'GBP': 0.75})
+    assert quotes[0]['quote_time'] == datetime(2026, 1, 2, tzinfo=timezone.utc)
@@ -0,0 +1,82 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+import main as gas_main
+from gas_site import GasSite
+from link_catalog import LinkCatalog
+
+MARKER = GasSite.gasbuddy_image.encode()
+CITY_SELECT = (b'<select id="ctl00_Content_P_PSC1_lstAreas"><option value="All Areas">All Areas</option>'
+               b'<option value="Toronto">Toronto</option></select>')
+
+PAGES = {
+    '/gasbuddy': b'<html>' + CITY_SELECT + b'<img src="' + MARKER + b'"></html>',
+    # The marker straddles the first 16 KB chunk
+    '/split': b'x' * (16384 - 20) + b'<img src="' + MARKER + b'">' + CITY_SELECT,
+    '/long': b'x' * 100000 + b'<img src="' + MARKER + b'">' + CITY_SELECT,
+    '/other': b'<html>mapquest</html>',
+}
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        StubHandler.requests.append(self.path)
+        body = PAGES.get(self.path)
+        if body is None:
+            self.send_response(429)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def base_url():
+    StubHandler.requests = []
+    server = HTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+def test_probe_finds_marker(base_url):
+    assert GasSite(f'{base_url}/gasbuddy').probe_is_gasbuddy() is True
+
+def test_probe_finds_marker_split_across_chunks(base_url):
+    assert GasSite(f'{base_url}/split').probe_is_gasbuddy() is True
+
+def test_probe_reads_whole_page_without_marker(base_url):
+    assert GasSite(f'{base_url}/other').probe_is_gasbuddy() is False
+
+def test_probe_past_max_bytes_is_inconclusive(base_url):
+    assert GasSite(f'{base_url}/long').probe_is_gasbuddy(max_bytes=32768) is None
+
+def test_probe_raises_on_error_status(base_url):
+    with pytest.raises(requests.HTTPError):
+        GasSite(f'{base_url}/limited').probe_is_gasbuddy()
+
+def test_discover_gasbuddy_areas(base_url, tmp_path):
+    catalog = LinkCatalog(str(tmp_path / 'link_catalog.sqlite'))
+    catalog.save_cities(f'{base_url}/split', [{'identifier': 'X', 'name': 'X', 'url': 'u'}])
+    catalog.save_gasbuddy_checks({f'{base_url}/other': False})
+    na_array = [
+        {'area_links': [f'{base_url}/gasbuddy', f'{base_url}/split', f'{base_url}/other']},
+        {'area_links': [f'{base_url}/gasbuddy', f'{base_url}/limited']},
+        {'city_links': []},
+    ]
+    gasbuddy_areas = gas_main.discover_gasbuddy_areas(na_array, catalog)
+    assert gasbuddy_areas == {f'{base_url}/gasbuddy', f'{base_url}/split'}
+    # Shared areas are fetched once, cached verdicts not at all
+    assert sorted(StubHandler.requests) == ['/gasbuddy', '/limited', '/split']
+    # The full fetch of an area without cached cities saves its cities, so discovery doesn't fetch it again
+    assert [city['name'] for city in catalog.get_cities(f'{base_url}/gasbuddy')] == ['All Areas', 'Toronto']
+    # The failed check is not cached, so it is retried next run
+    assert catalog.get_gasbuddy_checks([f'{base_url}/limited']) == {}
+    assert catalog.get_gasbuddy_checks([f'{base_url}/gasbuddy']) == {f'{base_url}/gasbuddy': True}
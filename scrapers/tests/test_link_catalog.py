@@ -0,0 +1,130 @@
+import sqlite3
+from datetime import timedelta
+
+import pytest
+
+from link_catalog import LinkCatalog
+from gas_site_links import GasSiteLinks
+
+EXPIRED = timedelta(seconds=-1)
+
+def state(state_code, area_links, name=None):
+    return {'link': f'https://example.com/{state_code}.shtml', 'name': name or state_code,
+            'state_code': state_code, 'area_links': area_links}
+
+def cities(*names):
+    return [{'identifier': name, 'name': name, 'url': f'https://example.com/{name}'} for name in names]
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'link_catalog.sqlite')
+
+def test_entries_are_fresh_until_their_own_refresh_after(path):
+    catalog = LinkCatalog(path)
+    catalog.save_states([state('AL', ['a.com'])])
+    assert not catalog.state_list_stale()
+    assert not catalog.get_states()[0]['stale']
+    # The refresh policy is stored per entry, so a catalog opened with other ages keeps it
+    expired = LinkCatalog(path, state_max_age=EXPIRED, area_max_age=EXPIRED)
+    assert not expired.state_list_stale()
+    expired.save_states([state('AK', ['b.com'])])
+    assert expired.state_list_stale()
+    assert {s['state_code']: s['stale'] for s in expired.get_states()} == {'AL': False, 'AK': True}
+
+def test_stale_areas_make_the_state_stale(path):
+    catalog = LinkCatalog(path, area_max_age=EXPIRED)
+    catalog.save_states([state('AL', ['a.com'])])
+    assert not catalog.state_list_stale()
+    assert catalog.get_states()[0]['stale']
+
+def test_touch_states_renews_only_the_state_entry(path):
+    LinkCatalog(path, state_max_age=EXPIRED).save_states([state('AL', ['a.com'])])
+    catalog = LinkCatalog(path)
+    catalog.touch_states(['AL'])
+    assert not catalog.state_list_stale()
+    assert catalog.get_states()[0]['area_links'] == ['a.com']
+
+def test_remove_states_except(path):
+    catalog = LinkCatalog(path)
+    catalog.save_states([state('AL', ['a.com']), state('AK', ['b.com'])])
+    catalog.remove_states_except([])
+    assert len(catalog.get_states()) == 2
+    catalog.remove_states_except(['AL'])
+    assert [s['state_code'] for s in catalog.get_states()] == ['AL']
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT domain FROM areas').fetchall() == [('a.com',)]
+    conn.close()
+
+def test_get_states_lower_cases_domains(path):
+    catalog = LinkCatalog(path)
+    catalog.save_states([state('AL', ['www.Birminghamgasprices.com', 'www.birminghamgasprices.com'])])
+    assert catalog.get_states()[0]['area_links'] == ['www.birminghamgasprices.com']
+
+def test_get_cities_include_stale(path):
+    catalog = LinkCatalog(path, city_max_age=EXPIRED)
+    assert catalog.get_cities('a.com') is None
+    catalog.save_cities('a.com', cities('X'))
+    assert catalog.get_cities('a.com') is None
+    assert catalog.get_cities('a.com', include_stale=True) == cities('X')
+    assert catalog.get_stale_city_domains() == ['a.com']
+
+def test_remove_cities_except(path):
+    catalog = LinkCatalog(path)
+    catalog.save_cities('a.com', cities('X'))
+    catalog.save_cities('b.com', cities('Y'))
+    catalog.remove_cities_except([])
+    catalog.remove_cities_except(['a.com'])
+    assert catalog.get_cities('a.com') == cities('X')
+    assert catalog.get_cities('b.com') is None
+
+def test_other_version_is_dropped(path):
+    catalog = LinkCatalog(path)
+    catalog.save_states([state('AL', ['a.com'])])
+    catalog.save_cities('a.com', cities('X'))
+    assert LinkCatalog(path).get_states()
+    conn = sqlite3.connect(path)
+    conn.execute(f'PRAGMA user_version = {LinkCatalog.VERSION + 1}')
+    conn.close()
+    catalog = LinkCatalog(path)
+    assert catalog.get_states() == []
+    assert catalog.get_cities('a.com') is None
+
+def test_gasbuddy_verdicts_expire(path):
+    catalog = LinkCatalog(path)
+    catalog.save_gasbuddy_checks({'a.com': True, 'www.mapquest.com': False})
+    assert catalog.get_gasbuddy_checks(['a.com', 'www.mapquest.com', 'c.com']) == {'a.com': True, 'www.mapquest.com': False}
+    LinkCatalog(path, gasbuddy_max_age=EXPIRED).save_gasbuddy_checks({'a.com': True})
+    assert catalog.get_gasbuddy_checks(['a.com']) == {}
+
+def links_with_index(catalog, us_links):
+    gas_site_links = GasSiteLinks(catalog=catalog)
+    gas_site_links.fetch_us_state_links = lambda: [state(s['state_code'], [], s['name']) for s in us_links]
+    gas_site_links.scrape_us_area_links = lambda s: [s['state_code'].lower() + '.com']
+    return gas_site_links
+
+def test_refresh_adds_renames_and_drops_states(path):
+    catalog = LinkCatalog(path, state_max_age=EXPIRED)
+    catalog.save_states([state('AL', ['old.com']), state('GN', ['gone.com'])])
+    links_with_index(catalog, [state('AL', [], 'Alabama'), state('AK', [])]).refresh_us_links()
+    states = {s['state_code']: s for s in catalog.get_states()}
+    assert sorted(states) == ['AK', 'AL']
+    assert states['AL']['name'] == 'Alabama'
+    assert states['AL']['area_links'] == ['al.com']
+    assert states['AK']['area_links'] == ['ak.com']
+
+def test_refresh_keeps_states_when_index_is_empty(path):
+    catalog = LinkCatalog(path, state_max_age=EXPIRED)
+    catalog.save_states([state('AL', ['old.com'])])
+    links_with_index(catalog, []).refresh_us_links()
+    assert [s['state_code'] for s in catalog.get_states()] == ['AL']
+
+def test_refresh_catalog_drops_cities_of_unlisted_areas(path):
+    catalog = LinkCatalog(path)
+    catalog.save_states([state('AL', ['a.com'])])
+    catalog.save_cities('a.com', cities('X'))
+    catalog.save_cities('gone.com', cities('Y'))
+    catalog.save_cities('www.bcgasprices.com', cities('Z'))
+    links_with_index(catalog, []).refresh_catalog()
+    assert catalog.get_cities('a.com') == cities('X')
+    assert catalog.get_cities('gone.com') is None
+    assert catalog.get_cities('www.bcgasprices.com') == cities('Z')
@@ -0,0 +1,103 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+import mpg_scraper
+
+def menu(*items):
+    return '<menuItems>' + ''.join(f'<menuItem><text>{text}</text><value>{value}</value></menuItem>' for text, value in items) + '</menuItems>'
+
+VEHICLES = {
+    '100': '''<vehicle><id>100</id><year>2024</year><make>Acura</make><model>Integra A-Spec</model>
+        <baseModel>Integra</baseModel><trany>Automatic (AV-S7)</trany><cylinders>4</cylinders><displ>1.5</displ>
+        <tCharger>T</tCharger><sCharger></sCharger><fuelType>Premium</fuelType><atvType></atvType>
+        <comb08>32</comb08><city08>29</city08><highway08>36</highway08><range>0</range></vehicle>''',
+    '101': '''<vehicle><id>101</id><year>2024</year><make>Acura</make><model>ZDX AWD</model>
+        <baseModel>ZDX</baseModel><trany>Automatic (A1)</trany><cylinders></cylinders><displ></displ>
+        <tCharger></tCharger><sCharger></sCharger><fuelType>Electricity</fuelType><atvType>EV</atvType>
+        <comb08>97</comb08><city08>104</city08><highway08>89</highway08><range>313</range></vehicle>''',
+    '102': '''<vehicle><id>102</id><year>2024</year><make>Acura</make><model>MDX PHEV</model>
+        <baseModel>MDX</baseModel><trany>Automatic (S10)</trany><cylinders>6</cylinders><displ>3.0</displ>
+        <tCharger>T</tCharger><sCharger></sCharger><fuelType>Premium and Electricity</fuelType><atvType>Plug-in Hybrid</atvType>
+        <comb08>23</comb08><city08>21</city08><highway08>26</highway08><combA08>60</combA08><range>0</range></vehicle>''',
+}
+
+MENUS = {
+    '/vehicle/menu/year': lambda query: menu(('2024', '2024')),
+    '/vehicle/menu/make': lambda query: menu(('Acura', 'Acura')),
+    '/vehicle/menu/model': lambda query: menu(('Integra A-Spec', 'Integra A-Spec'), ('ZDX AWD', 'ZDX AWD')),
+    '/vehicle/menu/options': lambda query: {
+        'Integra A-Spec': menu(('Auto', '100')),
+        'ZDX AWD': menu(('Auto', '101'), ('Auto', '999')),
+        'MDX PHEV': menu(('Auto', '102')),
+    }[query['model'][0]],
+}
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path[len('/ws/rest'):]
+        if path in MENUS:
+            body = MENUS[path](parse_qs(url.query))
+        elif path.startswith('/vehicle/') and path.split('/')[-1] in VEHICLES:
+            body = VEHICLES[path.split('/')[-1]]
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def base_url():
+    server = HTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/ws/rest'
+    server.shutdown()
+
+def test_get_years(base_url):
+    assert mpg_scraper.get_years(base_url) == [2024]
+
+def test_get_car_data_rest_maps_to_document_shape(base_url):
+    cars = mpg_scraper.get_car_data_rest('Acura', 'Integra A-Spec', 2024, base_url)
+    assert cars == [{
+        'year': 2024,
+        'make': 'Acura',
+        'model': 'Integra',
+        'name': '2024 Acura Integra A-Spec',
+        'trim': 'Auto (AV-S7), 4 cyl, 1.5 L, Turbo',
+        'fuel': 'Premium Gasoline',
+        'units': 'MPG',
+        'total_range': None,
+        'fuel_economy': {'combined': 32, 'city': 29, 'hwy': 36},
+        'img': None,
+    }]
+
+def test_get_car_data_rest_skips_missing_vehicles(base_url):
+    cars = mpg_scraper.get_car_data_rest('Acura', 'ZDX AWD', 2024, base_url)
+    assert len(cars) == 1
+    assert cars[0]['model'] == 'ZDX'
+    assert cars[0]['units'] == 'MPGe'
+    assert cars[0]['fuel'] == 'Electricity'
+    assert cars[0]['total_range'] == '313 miles'
+
+def test_plug_in_hybrid_keeps_gasoline_units(base_url):
+    cars = mpg_scraper.get_car_data_rest('Acura', 'MDX PHEV', 2024, base_url)
+    assert cars[0]['units'] == 'MPG'
+    assert cars[0]['fuel_economy'] == {'combined': 23, 'city': 21, 'hwy': 26}
+    assert cars[0]['fuel'] == 'Premium Gasoline and Electricity'
+    assert cars[0]['trim'] == 'Auto (S10), 6 cyl, 3.0 L, Turbo'
+
+def test_get_all_makes_models_years_rest(base_url, monkeypatch):
+    inserted = {}
+    monkeypatch.setattr(mpg_scraper, 'insert_new_car_data', lambda year, cars: inserted.update({year: cars}))
+    mpg_scraper.get_all_makes_models_years(source='rest', base_url=base_url)
+    assert [car['name'] for car in inserted[2024]] == ['2024 Acura Integra A-Spec', '2024 Acura ZDX AWD']
@@ -0,0 +1,74 @@
+import sqlite3
+import time
+
+import pytest
+
+from work_queue import WorkQueue
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'gas.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE cities (id INTEGER PRIMARY KEY, name TEXT, identifier TEXT, url TEXT, state_id INTEGER)')
+    conn.executemany('INSERT INTO cities (name, identifier, url, state_id) VALUES (?, ?, ?, 1)',
+                     [('All Areas', 'all', 'u0'), ('Toronto', 'toronto', 'u1'), ('Ottawa', 'ottawa', 'u2')])
+    conn.commit()
+    conn.close()
+    return path
+
+def test_enqueue_skips_all_areas(db_path):
+    queue = WorkQueue(db_path)
+    assert queue.enqueue_cities() == 2
+    assert queue.remaining() == 2
+
+def test_claimed_task_is_not_claimed_again(db_path):
+    queue = WorkQueue(db_path)
+    queue.enqueue_cities()
+    first = queue.claim('w1')
+    second = queue.claim('w2')
+    assert first['city_id'] != second['city_id']
+    assert queue.claim('w3') is None
+
+def test_expired_lease_is_reclaimed_and_old_owner_cannot_complete(db_path):
+    queue = WorkQueue(db_path, lease_seconds=0.2)
+    queue.enqueue_cities()
+    task = queue.claim('w1')
+    queue.claim('w1')
+    time.sleep(0.3)
+    reclaimed = queue.claim('w2')
+    assert reclaimed['city_id'] == task['city_id']
+    assert not queue.complete(task['city_id'], 'w1')
+    assert queue.complete(task['city_id'], 'w2')
+
+def test_task_fails_after_max_attempts(db_path):
+    queue = WorkQueue(db_path, max_attempts=2)
+    queue.enqueue_cities()
+    for _ in range(2):
+        tasks = [queue.claim('w1'), queue.claim('w1')]
+        for task in tasks:
+            queue.release(task['city_id'], 'w1')
+    assert queue.claim('w1') is None
+    assert queue.remaining() == 0
+    conn = sqlite3.connect(db_path)
+    statuses = [row[0] for row in conn.execute('SELECT status FROM crawl_tasks')]
+    conn.close()
+    assert statuses == ['failed', 'failed']
+
+def test_expired_lease_counts_as_an_attempt(db_path):
+    queue = WorkQueue(db_path, lease_seconds=0.1, max_attempts=1)
+    queue.enqueue_cities()
+    queue.claim('w1')
+    queue.claim('w1')
+    time.sleep(0.2)
+    assert queue.claim('w2') is None
+    assert queue.remaining() == 0
+
+def test_enqueue_requeues_finished_tasks(db_path):
+    queue = WorkQueue(db_path)
+    queue.enqueue_cities()
+    task = queue.claim('w1')
+    queue.complete(task['city_id'], 'w1')
+    leased = queue.claim('w1')
+    assert queue.enqueue_cities() == 1
+    assert queue.claim('w2')['city_id'] == task['city_id']
+    assert not queue.complete(leased['city_id'], 'w2')